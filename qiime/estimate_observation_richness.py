@@ -11,13 +11,27 @@ __email__ = "jai.rideout@gmail.com"
 
 """Contains functionality to estimate the observation richness of samples."""
 
-from bisect import insort
 from collections import defaultdict
 from csv import writer
 
 from biom.util import compute_counts_per_sample_stats
 from cogent.maths.stats.distribution import ndtri
-from numpy import empty, ones, sqrt, tensordot
+from numpy import (arange, asarray, bincount, cumprod, float64, insert, int64,
+                   maximum, newaxis, searchsorted, sqrt, zeros)
+
+# Load numba if it's available. If it's not, interpolation falls back to the
+# vectorized numpy implementation.
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Load numexpr if it's available. If it's not, the interpolation variance is
+# always computed with numpy.
+try:
+    from numexpr import evaluate
+except ImportError:
+    evaluate = None
 
 
 class EmptyTableError(Exception):
@@ -28,6 +42,42 @@ class EmptySampleError(Exception):
     pass
 
 
+if njit is None:
+    _accumulate_interpolation = None
+else:
+    @njit(cache=True)
+    def _accumulate_interpolation(n, sizes, fk):
+        """Return the sums in equations 4 and 5 of Colwell 2012 at each size.
+
+        sizes must be an int64 vector of sizes m <= n, and fk a float64 vector
+        where index k - 1 holds f_k. alpha_km is computed on the fly from its
+        recurrence, so the sums are accumulated in a single pass per size
+        without allocating any alpha_km values.
+        """
+        estimate_accs = zeros(sizes.shape[0])
+        var_accs = zeros(sizes.shape[0])
+
+        for i in range(sizes.shape[0]):
+            m = sizes[i]
+            estimate_acc = 0.0
+            var_acc = 0.0
+            alpha_km = 1.0
+
+            for k in range(1, n - m + 1):
+                alpha_km = alpha_km * (n - m - k + 1) / (n - k + 1)
+                estimate_acc += alpha_km * fk[k - 1]
+                var_acc += (1.0 - alpha_km) * (1.0 - alpha_km) * fk[k - 1]
+
+            # alpha_km is zero for k > n - m.
+            for k in range(n - m + 1, n + 1):
+                var_acc += fk[k - 1]
+
+            estimate_accs[i] = estimate_acc
+            var_accs[i] = var_acc
+
+        return estimate_accs, var_accs
+
+
 class ObservationRichnessEstimator(object):
 
     """Class to estimate richness of samples in a table at varying depths.
@@ -57,6 +107,9 @@ class ObservationRichnessEstimator(object):
         self._biom_table = biom_table
         self._point_estimator_cls = point_estimator_cls
 
+        # Computed on first use (requires a full pass over the table).
+        self._base_sample_size = None
+
     def getSampleCount(self):
         """Return the number of samples in the table."""
         return len(self._biom_table.ids())
@@ -85,7 +138,7 @@ class ObservationRichnessEstimator(object):
         """
         results = RichnessEstimatesResults()
 
-        for samp_data, samp_id, _ in self._biom_table.iter(axis='sample'):
+        for samp_data, samp_id in self._iter_sample_data():
             point_estimator = self._point_estimator_cls(samp_data)
             ref_indiv_count = point_estimator.getTotalIndividualCount()
 
@@ -95,38 +148,76 @@ class ObservationRichnessEstimator(object):
                                                  num_steps)
             results.addSample(samp_id, ref_indiv_count)
 
-            for size in sizes:
-                exp_obs_count, std_err, ci_low, ci_high = point_estimator(size,
-                                                                          confidence_level=confidence_level)
+            estimates = point_estimator.estimateBatch(
+                sizes, confidence_level=confidence_level)
+
+            for size, (exp_obs_count, std_err, ci_low, ci_high) in zip(
+                    sizes, estimates):
                 results.addSampleEstimate(samp_id, size, exp_obs_count,
                                           std_err, ci_low, ci_high)
         return results
 
+    def _iter_sample_data(self):
+        """Yields (sample data, sample ID) for each sample in the table.
+
+        If the table is backed by a scipy sparse matrix, it is converted to CSC
+        once and each sample's stored counts are sliced out directly, instead
+        of building a dense vector per sample. Zero counts may therefore be
+        omitted from the sample data, which the point estimators ignore anyway.
+        """
+        try:
+            matrix = self._biom_table.matrix_data.tocsc()
+        except AttributeError:
+            for samp_data, samp_id, _ in self._biom_table.iter(axis='sample'):
+                yield samp_data, samp_id
+        else:
+            indptr = matrix.indptr
+
+            for i, samp_id in enumerate(self._biom_table.ids(axis='sample')):
+                yield matrix.data[indptr[i]:indptr[i + 1]], samp_id
+
     def _get_points_to_estimate(self, reference_individual_count, start=1,
                                 stop=None, num_steps=10):
-        """Returns depths/sizes to estimate."""
-        if stop is None:
-            # Compute base sample size as stopping point.
-            min_size, max_size, _, _, _ = compute_counts_per_sample_stats(
-                self._biom_table)
-            stop = int(max(2 * min_size, max_size))
-
-        if start < 1 or num_steps < 1:
+        """Returns depths/sizes to estimate as a sorted numpy array."""
+        # Validate before computing the default stop, which requires a pass
+        # over the whole table.
+        if start < 1 or num_steps is None or num_steps < 1:
             raise ValueError("The minimum individual count and number of "
                              "steps must both be greater than or equal to 1.")
 
+        if stop is None:
+            stop = self._get_base_sample_size()
+
         if start > stop:
             raise ValueError("The minimum individual count must be less than "
                              "or equal to the maximum individual count.")
 
         step_size = max((stop - start) // num_steps, 1)
 
-        points = range(start, stop + 1, step_size)
-        if reference_individual_count not in points:
-            insort(points, reference_individual_count)
+        points = arange(start, stop + 1, step_size, dtype=int64)
+
+        # Find where the reference count belongs and only insert it if it
+        # isn't already there.
+        index = searchsorted(points, reference_individual_count)
+        if (index == len(points) or
+                points[index] != reference_individual_count):
+            points = insert(points, index, reference_individual_count)
 
         return points
 
+    def _get_base_sample_size(self):
+        """Returns the base sample size, used as the default stopping point.
+
+        This only depends on the table, so it is computed once and cached
+        instead of being recomputed for every sample.
+        """
+        if self._base_sample_size is None:
+            min_size, max_size, _, _, _ = compute_counts_per_sample_stats(
+                self._biom_table)
+            self._base_sample_size = int(max(2 * min_size, max_size))
+
+        return self._base_sample_size
+
 
 class AbstractPointEstimator(object):
 
@@ -146,15 +237,25 @@ class AbstractPointEstimator(object):
             sample_data - a 1-D numpy array containing observation counts in a
                 sample
         """
-        n = self._calculate_total_individual_count(sample_data)
+        # n, S_obs, and f_k only depend on the nonzero counts, so pull those
+        # out once and compute everything from that (typically much shorter)
+        # vector instead of making a separate pass over the sample for each.
+        counts = sample_data[sample_data > 0]
+
+        n = self._calculate_total_individual_count(counts)
         if n < 1:
             raise EmptySampleError("Encountered a sample without any recorded "
                                    "observations.")
         else:
             self._n = n
 
-        self._s_obs = self._calculate_observation_count(sample_data)
-        self._fk = self._calculate_abundance_frequency_counts(sample_data, n)
+        self._s_obs = self._calculate_observation_count(counts)
+
+        # Dense version of f_k as a contiguous int64 vector, where index k - 1
+        # holds the frequency count of abundance k. Subclasses can use this
+        # directly in vectorized computations.
+        self._fk_vector = self._calculate_abundance_frequency_vector(counts, n)
+        self._fk = self._calculate_abundance_frequency_counts(self._fk_vector)
 
     def getTotalIndividualCount(self):
         """Return the reference sample size (total number of individuals).
@@ -193,20 +294,37 @@ class AbstractPointEstimator(object):
         """
         raise NotImplementedError("Subclasses must implement __call__.")
 
-    def _calculate_total_individual_count(self, sample_data):
-        return int(sample_data.sum(0))
+    def estimateBatch(self, sizes, confidence_level=0.95):
+        """Estimate the richness at each of the given sizes.
 
-    def _calculate_observation_count(self, sample_data):
-        return int((sample_data > 0).sum(0))
+        Returns a list containing one (estimate, std_err, ci_low, ci_high)
+        tuple per size, in the same order as sizes.
 
-    def _calculate_abundance_frequency_counts(self, sample_data, n):
-        fk = defaultdict(int)
+        This calls __call__ once per size. Subclasses may override it with an
+        implementation that handles all sizes at once.
+        """
+        return [self(size, confidence_level=confidence_level)
+                for size in sizes]
+
+    # The following helpers expect only the nonzero counts of a sample.
+
+    def _calculate_total_individual_count(self, counts):
+        return int(counts.sum(0))
 
-        for i in range(1, n + 1):
-            fk_i = (sample_data == i).sum(0)
+    def _calculate_observation_count(self, counts):
+        return int(counts.size)
 
-            if fk_i > 0:
-                fk[i] = int(fk_i)
+    def _calculate_abundance_frequency_vector(self, counts, n):
+        # Tally all abundances in a single pass instead of scanning the sample
+        # once per possible abundance (1..n). Bin 0 is skipped.
+        freqs = bincount(counts.astype(int64), minlength=n + 1)
+        return freqs[1:].astype(int64, copy=False)
+
+    def _calculate_abundance_frequency_counts(self, fk_vector):
+        fk = defaultdict(int)
+
+        for i in fk_vector.nonzero()[0]:
+            fk[int(i) + 1] = int(fk_vector[i])
 
         return fk
 
@@ -220,16 +338,47 @@ class Chao1MultinomialPointEstimator(AbstractPointEstimator):
     Plant Ecology.
     """
 
+    # (n, sizes) -> alpha_km matrix for the most recent call to
+    # _alpha_km_matrix, shared across instances.
+    _alpha_cache = {}
+
+    # Minimum number of alpha_km values before numexpr (if available) is used
+    # to compute the interpolation variance.
+    _numexpr_min_size = 4096
+
     def __init__(self, sample_data):
         super(Chao1MultinomialPointEstimator, self).__init__(sample_data)
-        self._f_hat = self._calculate_f_hat(self.getAbundanceFrequencyCounts())
 
-        n = self.getTotalIndividualCount()
-        self._cov_matrix = self._calculate_covariance_matrix(
-            self.getAbundanceFrequencyCounts(), n,
-            self.estimateFullRichness())
+        # Everything that depends only on the sample (and not on the size
+        # being estimated) is computed once here rather than on every call.
+        fk = self.getAbundanceFrequencyCounts()
+        self._f1 = fk[1]
+        self._f2 = fk[2]
+        self._f_hat = self._calculate_f_hat(fk)
 
-        self._pd_matrix = ones((n, n))
+        # S_est = S_obs + f_hat
+        self._s_est = self.getObservationCount() + self._f_hat
+
+        # float64 copy of f_k for the interpolation sums, so the dot products
+        # and the jitted kernel never mix integer and float operands.
+        self._fk_float_vector = self._fk_vector.astype(float64)
+
+        # Total of f_k for k > 2. Only f1 and f2 have partial derivatives
+        # other than 1 in the extrapolation variance, so this is all that's
+        # needed of the remaining f_k.
+        self._f_rest = self._fk_float_vector[2:].sum()
+
+        # Base of the power in equation 9 of Colwell 2012,
+        # 1 - f1 / (n * f_hat), which doesn't depend on the size being
+        # estimated. This is undefined if we have exactly one singleton and no
+        # doubletons, or no singletons and no doubletons, in which case we
+        # can't extrapolate.
+        try:
+            self._extrapolation_base = 1 - (self._f1 /
+                                            (self.getTotalIndividualCount() *
+                                             self._f_hat))
+        except ZeroDivisionError:
+            self._extrapolation_base = None
 
     def estimateUnobservedObservationCount(self):
         """Return estimated number of observations not found in this sample.
@@ -243,105 +392,188 @@ class Chao1MultinomialPointEstimator(AbstractPointEstimator):
 
         This is S_est_Chao1 in Colwell 2012, which is S_obs + f_0_hat_Chao1.
         """
-        # S_est = S_obs + f_hat
-        return self.getObservationCount() + \
-            self.estimateUnobservedObservationCount()
+        return self._s_est
 
     def __call__(self, size, confidence_level=0.95):
+        return self.estimateBatch([size],
+                                  confidence_level=confidence_level)[0]
+
+    def estimateBatch(self, sizes, confidence_level=0.95):
         if confidence_level <= 0 or confidence_level >= 1:
             raise ValueError("Invalid confidence level: %.4f. Must be between "
                              "zero and one (exclusive)." % confidence_level)
 
         # We'll use the variable names from Colwell 2012 for clarity and
         # brevity.
-        m = size
-        fk = self.getAbundanceFrequencyCounts()
+        m = asarray(sizes, dtype=int64)
         n = self.getTotalIndividualCount()
-        s_obs = self.getObservationCount()
-        s_est = self.estimateFullRichness()
 
-        if m <= n:
-            # Interpolation.
+        estimates = zeros(len(m))
+        std_errs = zeros(len(m))
 
-            # Equation 4 in Colwell 2012 for the estimate.
-            estimate_acc = 0
+        # Interpolation.
+        interpolated = m <= n
+        if interpolated.any():
+            estimates[interpolated], std_errs[interpolated] = \
+                self._interpolate(m[interpolated])
 
-            # Equation 5 in Colwell 2012 gives unconditional variance, but they
-            # report the standard error (SE) (which is the same as the standard
-            # deviation in this case) in their tables and use this to construct
-            # confidence intervals. Thus, we compute SE as sqrt(variance).
-            std_err_acc = 0
+        # Extrapolation.
+        extrapolated = ~interpolated
+        defined = interpolated
+        if extrapolated.any() and self._extrapolation_base is not None:
+            estimates[extrapolated], std_errs[extrapolated] = \
+                self._extrapolate(m[extrapolated] - n)
+            defined = interpolated | extrapolated
 
-            for k in range(1, n + 1):
-                alpha_km = self._calculate_alpha_km(n, k, m)
-                estimate_acc += alpha_km * fk[k]
-                std_err_acc += (((1 - alpha_km) ** 2) * fk[k])
+        # Compute CI based on std_err.
+        ci_bounds = self._calculate_z_crit(confidence_level) * std_errs
+        ci_lows = estimates - ci_bounds
+        ci_highs = estimates + ci_bounds
+
+        results = []
+        for is_defined, estimate, std_err, ci_low, ci_high in zip(
+                defined, estimates.tolist(), std_errs.tolist(),
+                ci_lows.tolist(), ci_highs.tolist()):
+            if is_defined:
+                results.append((estimate, std_err, ci_low, ci_high))
+            else:
+                results.append((None, None, None, None))
 
-            estimate = s_obs - estimate_acc
+        return results
 
-            # Convert variance to standard error.
-            std_err = sqrt(std_err_acc - (estimate ** 2 / s_est))
+    def _interpolate(self, m):
+        """Return the estimates and their standard errors at sizes m <= n.
+
+        m must be an int64 vector of sizes. The alpha_km terms are computed
+        once per size and shared by both sums.
+        """
+        n = self.getTotalIndividualCount()
+        s_obs = self.getObservationCount()
+        s_est = self.estimateFullRichness()
+        fk = self._fk_float_vector
+
+        # Equation 4 in Colwell 2012 for the estimate.
+        #
+        # Equation 5 in Colwell 2012 gives unconditional variance, but they
+        # report the standard error (SE) (which is the same as the standard
+        # deviation in this case) in their tables and use this to construct
+        # confidence intervals. Thus, we compute SE as sqrt(variance).
+        if _accumulate_interpolation is not None:
+            estimate_accs, var_accs = _accumulate_interpolation(n, m, fk)
         else:
-            # Extrapolation.
-            m_star = m - n
-            f1 = fk[1]
-            f2 = fk[2]
-            f_hat = self.estimateUnobservedObservationCount()
-
-            try:
-                # Equation 9 in Colwell 2012.
-                estimate = s_obs + f_hat * (1 -
-                                            (1 - (f1 / (n * f_hat))) ** m_star)
-            except ZeroDivisionError:
-                # This can happen if we have exactly one singleton and no
-                # doubletons, or no singletons and no doubletons.
-                estimate = None
-                std_err = None
+            # alpha_km with one row per size and k = 1..n as the columns,
+            # lined up with f_k.
+            alpha = self._alpha_km_matrix(n, m)
+            estimate_accs = alpha.dot(fk)
+
+            # For large alpha_km matrices, numexpr evaluates this in
+            # cache-sized blocks instead of allocating full-size temporaries
+            # for (1 - alpha) and its square.
+            if evaluate is not None and alpha.size > self._numexpr_min_size:
+                var_accs = evaluate('sum((1 - alpha) ** 2 * fk, axis=1)',
+                                    local_dict={'alpha': alpha, 'fk': fk})
             else:
-                # Equation 10 in Colwell 2012. I used Wolfram Alpha to
-                # calculate the analytic partial derivatives since they weren't
-                # provided in the original paper. We have two partial
-                # derivatives, wrt f1 and f2, that we really care about. All
-                # other partial derivatives (e.g. wrt f3, f4, etc.) get a value
-                # of 1.
-                pd_f1 = self._partial_derivative_f1(f1, f2, m_star, n)
-                pd_f2 = self._partial_derivative_f2(f1, f2, m_star, n)
-                pd_f1f2 = pd_f1 * pd_f2
-
-                # To do this efficiently, here's the algorithm:
-                #
-                # 1) Create nxn array filled with ones. Each element represents
-                #    the multiplication of two partial derivatives.
-                # 2) Fill in only what we need: the multiplication of partial
-                #    derivatives wrt f1 and f2.
-                # 3) Do an element-wise multiply between our partial derivative
-                #    matrix and the covariance matrix. tensordot does this and
-                #    also sums the result, which is exactly what we need. In
-                #    the end, we've summed all n^2 elements, each of which are
-                #    (pd_fi * pd_fj * cov_ij).
-                self._pd_matrix[0, :] = pd_f1
-                self._pd_matrix[1, :] = pd_f2
-                self._pd_matrix[:, 0] = pd_f1
-                self._pd_matrix[:, 1] = pd_f2
-
-                self._pd_matrix[0, 0] = pd_f1 ** 2
-                self._pd_matrix[0, 1] = pd_f1f2
-                self._pd_matrix[1, 0] = pd_f1f2
-                self._pd_matrix[1, 1] = pd_f2 ** 2
-
-                std_err = sqrt(tensordot(self._pd_matrix, self._cov_matrix))
+                var_accs = ((1 - alpha) ** 2).dot(fk)
 
-        # Compute CI based on std_err.
-        ci_low = None
-        ci_high = None
-        if std_err is not None:
+        estimates = s_obs - estimate_accs
+
+        # Convert variance to standard error. The two terms of the variance
+        # can cancel almost exactly (e.g. at m = n when f_hat is close to
+        # zero), so clamp tiny negative results from rounding to zero.
+        variances = var_accs - (estimates ** 2 / s_est)
+        std_errs = sqrt(maximum(variances, 0.0))
+
+        return estimates, std_errs
+
+    def _extrapolate(self, m_star):
+        """Return the estimates and their standard errors at sizes n + m_star.
+
+        m_star must be an int64 vector. Must only be called if extrapolation is
+        defined for this sample (i.e. self._extrapolation_base is not None).
+        """
+        n = self.getTotalIndividualCount()
+        s_obs = self.getObservationCount()
+        s_est = self.estimateFullRichness()
+        f1 = self._f1
+        f2 = self._f2
+        f_hat = self.estimateUnobservedObservationCount()
+
+        # The base of the power in equation 9 is the same a_0 (or a_1, if
+        # there are no doubletons) that the partial derivatives below raise to
+        # m_star - 1 and m_star, so compute those powers once and share them.
+        powers = self._calculate_powers(self._extrapolation_base, m_star)
+
+        # Equation 9 in Colwell 2012. Only the exponent depends on the size.
+        estimates = s_obs + f_hat * (1 - powers[1])
+
+        # Equation 10 in Colwell 2012. I used Wolfram Alpha to calculate the
+        # analytic partial derivatives since they weren't provided in the
+        # original paper. We have two partial derivatives, wrt f1 and f2, that
+        # we really care about. All other partial derivatives (e.g. wrt f3, f4,
+        # etc.) get a value of 1.
+        pd_f1 = self._partial_derivative_f1(f1, f2, m_star, n, powers)
+        pd_f2 = self._partial_derivative_f2(f1, f2, m_star, n, powers)
+
+        # The variance is the sum over all n^2 elements
+        # (pd_fi * pd_fj * cov_ij), where cov_ii = f_i * (1 - f_i / S_est) and
+        # cov_ij = -f_i * f_j / S_est for i != j. That sum collapses
+        # algebraically to
+        #
+        #     sum(pd_fi^2 * f_i) - sum(pd_fi * f_i)^2 / S_est
+        #
+        # and since pd_fi is 1 for every i > 2, both sums only need f1, f2, and
+        # the total of the remaining f_k.
+        f_rest = self._f_rest
+        sum_sq = (pd_f1 ** 2) * f1 + (pd_f2 ** 2) * f2 + f_rest
+        sum_lin = pd_f1 * f1 + pd_f2 * f2 + f_rest
+
+        # The variance is non-negative in exact arithmetic (the covariance
+        # matrix is positive semidefinite), so only clamp away rounding error.
+        std_errs = sqrt(maximum(sum_sq - (sum_lin ** 2 / s_est), 0.0))
+
+        return estimates, std_errs
+
+    def _alpha_km_matrix(self, n, m):
+        """Return alpha_km for each size in m (rows) and k = 1..n (columns).
+
+        Rather than evaluating the factorials for each k, this uses the
+        recurrence alpha_km = alpha_(k-1)m * (n - m - k + 1) / (n - k + 1),
+        starting from alpha_0m = 1, as a cumulative product along each row.
+        The ratio is zero at k = n - m + 1 and is clipped to zero beyond that,
+        so alpha_km is zero for k > n - m.
+
+        alpha_km only depends on n and the sizes, which are identical for
+        consecutive samples in a rarefied table, so the most recent result is
+        cached across instances. Only one matrix is kept because each holds
+        len(m) * n floats and samples with different n never share one. The
+        returned matrix is read-only.
+        """
+        cache = Chao1MultinomialPointEstimator._alpha_cache
+        key = (n, tuple(m.tolist()))
+
+        if key not in cache:
+            cache.clear()
+
+            k = arange(1, n + 1)
+            ratios = (n - m[:, newaxis] - k + 1) / (n - k + 1)
+            alpha = cumprod(maximum(ratios, 0), axis=1)
+            alpha.setflags(write=False)
+
+            cache[key] = alpha
+
+        return cache[key]
+
+    def _calculate_z_crit(self, confidence_level, cache={}):
+        """Return the critical value for the given confidence level.
+
+        This is the same for every size and every sample, so it is cached
+        instead of evaluating ndtri on each call.
+        """
+        if confidence_level not in cache:
             # z_crit will be something like 1.96 for 95% CI.
-            z_crit = abs(ndtri((1 - confidence_level) / 2))
-            ci_bound = z_crit * std_err
-            ci_low = estimate - ci_bound
-            ci_high = estimate + ci_bound
+            cache[confidence_level] = abs(ndtri((1 - confidence_level) / 2))
 
-        return estimate, std_err, ci_low, ci_high
+        return cache[confidence_level]
 
     def _calculate_f_hat(self, fk):
         # Based on equations 15a and 15b in Colwell 2012.
@@ -362,39 +594,68 @@ class Chao1MultinomialPointEstimator(AbstractPointEstimator):
     # I lost my sanity somewhere around this point... :P Sorry for anyone that
     # has to read this!
 
-    def _partial_derivative_f1(self, f1, f2, m_star, n):
-        """Derived from equation 9 using Wolfram Alpha, wrt f1."""
+    def _partial_derivative_f1(self, f1, f2, m_star, n, powers=None):
+        """Derived from equation 9 using Wolfram Alpha, wrt f1.
+
+        powers may be given as (a ** (m_star - 1), a ** m_star), where a is
+        a_0 or a_1 (whichever applies), if the caller already has them.
+        """
         if f1 > 0 and f2 > 0:
-            a_0 = self._calculate_a_0(f1, f2, n)
-            term1 = (m_star * a_0 ** (m_star - 1)) / n
-            term2 = (f1 * (1 - a_0 ** m_star)) / f2
+            if powers is None:
+                powers = self._calculate_powers(
+                    self._calculate_a_0(f1, f2, n), m_star)
+            a_0_m_star_1, a_0_m_star = powers
+
+            term1 = (m_star * a_0_m_star_1) / n
+            term2 = (f1 * (1 - a_0_m_star)) / f2
             return 1 - term1 + term2
         else:
-            a_1 = self._calculate_a_1(f1, f2, n)
-            term1 = (m_star * f1) * a_1 ** (m_star - 1)
+            if powers is None:
+                powers = self._calculate_powers(
+                    self._calculate_a_1(f1, f2, n), m_star)
+            a_1_m_star_1, a_1_m_star = powers
+
+            term1 = (m_star * f1) * a_1_m_star_1
             term2 = n * (f1 - 1)
-            term3 = (f1 - 1) * (1 - a_1 ** m_star)
+            term3 = (f1 - 1) * (1 - a_1_m_star)
             term4 = 2 * (f2 + 1)
-            term5 = f1 * (1 - a_1 ** m_star)
+            term5 = f1 * (1 - a_1_m_star)
             return 1 - (term1 / term2) + (term3 / term4) + (term5 / term4)
 
-    def _partial_derivative_f2(self, f1, f2, m_star, n):
-        """Derived from equation 9 using Wolfram Alpha, wrt f2."""
+    def _partial_derivative_f2(self, f1, f2, m_star, n, powers=None):
+        """Derived from equation 9 using Wolfram Alpha, wrt f2.
+
+        powers may be given as (a ** (m_star - 1), a ** m_star), where a is
+        a_0 or a_1 (whichever applies), if the caller already has them.
+        """
         if f1 > 0 and f2 > 0:
-            a_0 = self._calculate_a_0(f1, f2, n)
-            term1 = (f1 ** 2) * (1 - a_0 ** m_star)
+            if powers is None:
+                powers = self._calculate_powers(
+                    self._calculate_a_0(f1, f2, n), m_star)
+            a_0_m_star_1, a_0_m_star = powers
+
+            term1 = (f1 ** 2) * (1 - a_0_m_star)
             term2 = 2 * (f2 ** 2)
-            term3 = (m_star * f1) * (a_0 ** (m_star - 1))
+            term3 = (m_star * f1) * a_0_m_star_1
             term4 = n * f2
             return 1 - (term1 / term2) + (term3 / term4)
         else:
-            a_1 = self._calculate_a_1(f1, f2, n)
-            term1 = (m_star * f1) * a_1 ** (m_star - 1)
+            if powers is None:
+                powers = self._calculate_powers(
+                    self._calculate_a_1(f1, f2, n), m_star)
+            a_1_m_star_1, a_1_m_star = powers
+
+            term1 = (m_star * f1) * a_1_m_star_1
             term2 = n * (f2 + 1)
-            term3 = (f1 * (f1 - 1)) * (1 - a_1 ** m_star)
+            term3 = (f1 * (f1 - 1)) * (1 - a_1_m_star)
             term4 = 2 * (f2 + 1) ** 2
             return 1 + (term1 / term2) - (term3 / term4)
 
+    def _calculate_powers(self, a, m_star):
+        # Returns (a ** (m_star - 1), a ** m_star) with a single power.
+        a_m_star_1 = a ** (m_star - 1)
+        return a_m_star_1, a_m_star_1 * a
+
     def _calculate_a_0(self, f1, f2, n):
         # I made up the names a_0 and a_1 (they're not in the paper) to break
         # out common terms from the above partial derivatives.
@@ -403,56 +664,6 @@ class Chao1MultinomialPointEstimator(AbstractPointEstimator):
     def _calculate_a_1(self, f1, f2, n):
         return 1 - ((2 * (f2 + 1)) / (n * (f1 - 1)))
 
-    def _calculate_alpha_km(self, n, k, m):
-        alpha_km = 0
-        diff = n - m
-
-        if k <= diff:
-            alpha_km = ((self._factorial(n - k) * self._factorial(diff)) /
-                        (self._factorial(n) * self._factorial(diff - k)))
-
-        return alpha_km
-
-    def _factorial(self, n, cache=[1, 1]):
-        """Dynamic programming factorial!
-
-        Using Python's built-in factorial was very slow. This implementation
-        cut down a lot of time.
-
-        Taken and modified from:
-            http://code.activestate.com/recipes/577241-faster-factorial
-        """
-        if n < len(cache):
-            return cache[n]
-        else:
-            last = len(cache) - 1
-            total = cache[last]
-
-            for i in range(last + 1, n + 1):
-                total *= i
-                cache.append(total)
-
-            return total
-
-    def _calculate_covariance_matrix(self, fk, n, s_est):
-        # This is pretty expensive... need to find a way to speed this method
-        # up.
-        result = empty((n, n))
-
-        for i in range(0, n):
-            f_i = fk[i + 1]
-
-            for j in range(0, i + 1):
-                if i != j:
-                    f_j = fk[j + 1]
-                    cov = -(f_i * f_j) / s_est
-                    result[i, j] = cov
-                    result[j, i] = cov
-                else:
-                    result[i, j] = f_i * (1 - f_i / s_est)
-
-        return result
-
 
 class RichnessEstimatesResults(object):
 
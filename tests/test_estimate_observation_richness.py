@@ -17,9 +17,10 @@ from StringIO import StringIO
 from biom.parse import parse_biom_table
 from biom.table import Table
 from unittest import TestCase, main
-from numpy.testing import assert_almost_equal
-from numpy import asarray, array
+from numpy.testing import assert_almost_equal, assert_array_equal
+from numpy import asarray, array, int64
 
+from qiime import estimate_observation_richness
 from qiime.estimate_observation_richness import (AbstractPointEstimator,
                                                  Chao1MultinomialPointEstimator, EmptySampleError,
                                                  EmptyTableError, ObservationRichnessEstimator,
@@ -111,6 +112,16 @@ class ObservationRichnessEstimatorTests(TestCase):
                                   (30, 5.4415544562981095, 1.073911829557642, 3.33672594779,
                                    7.5463829648)])
 
+    def test_call_call_only_point_estimator(self):
+        """Test __call__ with a point estimator lacking estimateBatch."""
+        estimator = ObservationRichnessEstimator(self.biom_table1,
+                                                 CallOnlyPointEstimator)
+        obs = estimator(start=1, stop=15, num_steps=2)
+        self.assertEqual(obs.getSampleCount(), 1)
+        assert_almost_equal(obs.getEstimates('S1'),
+                            [(1, 1, 0.95, 0, 2), (8, 8, 0.95, 7, 9),
+                             (15, 15, 0.95, 14, 16)])
+
     def test_get_points_to_estimate_invalid_input(self):
         """Raises an error on invalid input."""
         # Invalid min.
@@ -120,6 +131,12 @@ class ObservationRichnessEstimatorTests(TestCase):
         # Invalid num_steps.
         self.assertRaises(ValueError, self.estimator1._get_points_to_estimate,
                           5, 1, 10, 0)
+        self.assertRaises(ValueError, self.estimator1._get_points_to_estimate,
+                          5, 1, 10, None)
+
+        # Invalid num_steps, stop not supplied.
+        self.assertRaises(ValueError, self.estimator1._get_points_to_estimate,
+                          5, 1, None, 0)
 
         # max < min.
         self.assertRaises(ValueError, self.estimator1._get_points_to_estimate,
@@ -129,15 +146,15 @@ class ObservationRichnessEstimatorTests(TestCase):
         """Correctly calculates estimation points given range parameters."""
         # Ref in range.
         obs = self.estimator1._get_points_to_estimate(4, 1, 5, 4)
-        self.assertEqual(obs, [1, 2, 3, 4, 5])
+        assert_array_equal(obs, [1, 2, 3, 4, 5])
 
         # Ref not in range.
         obs = self.estimator1._get_points_to_estimate(4, 5, 10, 2)
-        self.assertEqual(obs, [4, 5, 7, 9])
+        assert_array_equal(obs, [4, 5, 7, 9])
 
         # stop not supplied.
         obs = self.estimator1._get_points_to_estimate(5, 5, num_steps=2)
-        self.assertEqual(obs, [5, 17, 29])
+        assert_array_equal(obs, [5, 17, 29])
 
 
 class AbstractPointEstimatorTests(TestCase):
@@ -196,6 +213,17 @@ class AbstractPointEstimatorTests(TestCase):
         with self.assertRaises(NotImplementedError):
             self.est1(1)
 
+    def test_estimateBatch(self):
+        """Test default estimateBatch goes through __call__ for each size."""
+        # AbstractPointEstimator doesn't implement __call__.
+        with self.assertRaises(NotImplementedError):
+            self.est1.estimateBatch([1, 2])
+
+        est = CallOnlyPointEstimator(asarray([0, 1, 2, 3, 4, 5]))
+        obs = est.estimateBatch([3, 1, 20], confidence_level=0.9)
+        self.assertEqual(obs, [(3, 0.9, 2, 4), (1, 0.9, 0, 2),
+                               (20, 0.9, 19, 21)])
+
 
 class Chao1MultinomialPointEstimatorTests(TestCase):
 
@@ -323,6 +351,108 @@ class Chao1MultinomialPointEstimatorTests(TestCase):
         assert_almost_equal(obs, (335.67575295919767, 48.962273606327834,
                                     239.71146009, 431.640045829))
 
+    def test_estimateBatch(self):
+        """Test computing estimates at multiple sizes at once."""
+        # Verified against results in Colwell 2012 paper. Sizes are
+        # deliberately unsorted and mix interpolation and extrapolation.
+        obs = self.estimator2.estimateBatch([337, 1, 237, 20])
+        self.assertEqual(len(obs), 4)
+        assert_almost_equal(obs[0], (145.7369598336187, 12.20489285355208,
+                                     121.815809405, 169.658110262))
+        assert_almost_equal(obs[1], (1.0, 0.20541870170521284, 0.597386742907,
+                                     1.40261325709))
+        assert_almost_equal(obs[2], (112.00, 9.22019783913399, 93.928744305,
+                                     130.071255695))
+        assert_almost_equal(obs[3], (15.891665207609165, 1.9486745986194465,
+                                     12.0723331767, 19.7109972385))
+
+        # Should match computing each size individually.
+        sizes = [1, 100, 800, 976, 1076, 1976]
+        obs = self.estimator1.estimateBatch(sizes, confidence_level=0.9)
+        for size, batch_obs in zip(sizes, obs):
+            assert_almost_equal(batch_obs,
+                                self.estimator1(size, confidence_level=0.9))
+
+        # Extrapolation isn't defined without singletons or doubletons.
+        est = Chao1MultinomialPointEstimator(asarray([4, 3, 4, 5]))
+        obs = est.estimateBatch([42, 16])
+        self.assertEqual(obs[0], (None, None, None, None))
+        assert_almost_equal(obs[1], (4.0, 0.0, 4.0, 4.0))
+
+        with self.assertRaises(ValueError):
+            self.estimator1.estimateBatch([1, 42], confidence_level=1)
+
+    def test_interpolate_numba_and_numpy(self):
+        """Test interpolation with both the numba kernel and numpy."""
+        # Verified against results in Colwell 2012 paper.
+        sizes = asarray([1, 100, 800, 976], dtype=int64)
+        exp_estimates = [1.0, 44.295771605749465, 126.7974481741264, 140]
+        exp_std_errs = [0.17638208235509734, 4.3560838094150975,
+                        7.7007346056227375, 8.4270097160038446]
+
+        # The kernel is only defined if numba could be imported. None selects
+        # the numpy implementation.
+        kernel = estimate_observation_richness._accumulate_interpolation
+        if kernel is None:
+            paths = [None]
+        else:
+            paths = [kernel, None]
+
+        try:
+            for path in paths:
+                estimate_observation_richness._accumulate_interpolation = path
+                estimates, std_errs = self.estimator1._interpolate(sizes)
+                assert_almost_equal(estimates, exp_estimates)
+                assert_almost_equal(std_errs, exp_std_errs)
+        finally:
+            estimate_observation_richness._accumulate_interpolation = kernel
+
+    def test_interpolate_numexpr(self):
+        """Test interpolation variance with numexpr matches numpy."""
+        evaluate = estimate_observation_richness.evaluate
+        if evaluate is None:
+            self.skipTest("numexpr is not installed.")
+
+        sizes = asarray([1, 100, 800, 976], dtype=int64)
+        kernel = estimate_observation_richness._accumulate_interpolation
+
+        try:
+            # numpy only.
+            estimate_observation_richness._accumulate_interpolation = None
+            estimate_observation_richness.evaluate = None
+            exp = self.estimator1._interpolate(sizes)
+
+            # numexpr, forced on for this (small) sample.
+            estimate_observation_richness.evaluate = evaluate
+            self.estimator1._numexpr_min_size = 0
+            obs = self.estimator1._interpolate(sizes)
+        finally:
+            estimate_observation_richness._accumulate_interpolation = kernel
+            estimate_observation_richness.evaluate = evaluate
+
+        assert_almost_equal(obs, exp)
+
+    def test_alpha_km_matrix(self):
+        """Test alpha_km matrix is correct, read-only, and cached."""
+        sizes = asarray([1, 2, 4], dtype=int64)
+        obs = self.estimator3._alpha_km_matrix(4, sizes)
+        exp = array([[0.75, 0.5, 0.25, 0.0],
+                     [0.5, 1 / 6, 0.0, 0.0],
+                     [0.0, 0.0, 0.0, 0.0]])
+        assert_almost_equal(obs, exp)
+        self.assertFalse(obs.flags.writeable)
+
+        # Same n and sizes from another instance is a cache hit.
+        est = Chao1MultinomialPointEstimator(self.samp_data2)
+        self.assertTrue(est._alpha_km_matrix(4, sizes.copy()) is obs)
+
+        # A different key replaces the cached matrix rather than adding to it.
+        other = self.estimator3._alpha_km_matrix(5, sizes)
+        self.assertTrue(other is not obs)
+        self.assertEqual(len(Chao1MultinomialPointEstimator._alpha_cache), 1)
+        self.assertTrue(
+            self.estimator3._alpha_km_matrix(4, sizes) is not obs)
+
     def test_call_invalid_input(self):
         """Test error is raised on invalid input."""
         with self.assertRaises(ValueError):
@@ -350,6 +480,12 @@ class Chao1MultinomialPointEstimatorTests(TestCase):
         obs = self.estimator1._partial_derivative_f1(0, 0, 10, 42)
         assert_almost_equal(obs, 1.2961664362634027)
 
+        # Precomputed powers of a_0.
+        a_0 = self.estimator1._calculate_a_0(2, 3, 42)
+        obs = self.estimator1._partial_derivative_f1(2, 3, 10, 42,
+                                                     (a_0 ** 9, a_0 ** 10))
+        assert_almost_equal(obs, 1.22672908818)
+
     def test_partial_derivative_f2(self):
         """Test computes correct partial derivative wrt f2."""
         # Verified with Wolfram Alpha.
@@ -366,6 +502,24 @@ class Chao1MultinomialPointEstimatorTests(TestCase):
         obs = self.estimator1._partial_derivative_f2(0, 0, 10, 42)
         assert_almost_equal(obs, 1.0)
 
+        # Precomputed powers of a_1.
+        a_1 = self.estimator1._calculate_a_1(2, 0, 42)
+        obs = self.estimator1._partial_derivative_f2(2, 0, 10, 42,
+                                                     (a_1 ** 9, a_1 ** 10))
+        assert_almost_equal(obs, 0.9208698803111386)
+
+
+class CallOnlyPointEstimator(AbstractPointEstimator):
+
+    """Point estimator that only implements __call__.
+
+    The estimate is the size itself and the standard error is the confidence
+    level, so results are easy to check.
+    """
+
+    def __call__(self, size, confidence_level=0.95):
+        return size, confidence_level, size - 1, size + 1
+
 
 class RichnessEstimatesResultsTests(TestCase):
 